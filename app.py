@@ -1,12 +1,13 @@
-import html
 import os
 import subprocess
-from datetime import datetime
+import time
+from datetime import datetime, timezone
+from importlib.util import find_spec
 
 import click
-import feedparser
-import requests
+import orjson
 from flask import (
+    Response,
     flash,
     jsonify,
     redirect,
@@ -25,15 +26,31 @@ from flask_login import (
 )
 from flask_wtf import FlaskForm
 from flask_wtf.csrf import CSRFError, CSRFProtect
-from ftfy import fix_text
+from sqlalchemy.orm import lazyload, selectinload
 from wtforms import PasswordField, StringField, SubmitField
 from wtforms.validators import DataRequired, Length
 
 from _config import app, db
 from functions import (
+    bulk_tag,
+    cached_feed,
+    clean_text,
+    fetch_concurrently,
+    fetch_json_feed_items,
+    fetch_rss_feed_entries,
     get_change_by_id,
+    get_conditional_headers,
     get_entries_by_tag_or_not,
+    get_entry_data_by_tag_or_not,
+    get_existing_feed_ids,
+    get_feed_urls,
+    get_or_create_tag,
+    insert_feed_entries,
+    parse_published_at,
     rfc_3339_date,
+    save_feed_validators,
+    stream_feed_template,
+    unescape_entry_titles,
     update_or_create_change,
 )
 from models import FeedEntry, Tag
@@ -88,6 +105,29 @@ class LoginForm(FlaskForm):
     submit = SubmitField('Login')
 
 
+error_template = app.jinja_env.get_template('error.html')
+
+
+def render_error(msg):
+    """Render the error page with a message.
+
+    The error template is looked up once when the app starts rather than
+    on every error response.
+
+    Args:
+        msg (str): The error message to display.
+
+    Returns:
+        str: The rendered HTML of the error page.
+    """
+    return render_template(
+        error_template,
+        msg=msg,
+        logo=app.config['LOGO'],
+        f_logo=app.config['FOOTER_LOGO'],
+    )
+
+
 @login_manager.user_loader
 def load_user(user_id):
     """Load a user by their unique identifier.
@@ -104,11 +144,13 @@ def load_user(user_id):
 def fetch_rss_feed():
     """Fetch and store RSS feed entries in the database.
 
-    This function retrieves the RSS feed from the URL specified in the
-    application configuration. It parses the feed, reverses the order of
-    the entries, and adds any new entries to the database if they do not
-    already exist. Each entry is stored with its title, feed ID, link,
-    publication date, and description.
+    This function retrieves the RSS feed(s) from the URL or list of URLs
+    specified in the application configuration. The feeds are downloaded
+    and parsed in parallel with fetch_rss_feed_entries, which returns each
+    feed's entries in reverse order, and any new entries are added to the
+    database if they do not already exist. Each entry is stored with its
+    title, feed ID, link, publication date (in UTC), and description.
+    Entries without a publication date get the time they were imported.
 
     If the RSS_FEED_URL is not configured, a message is printed to the
     console indicating the missing configuration.
@@ -117,76 +159,93 @@ def fetch_rss_feed():
         None
     """
     with app.app_context():
-        if not app.config['RSS_FEED_URL']:
+        urls = get_feed_urls('RSS_FEED_URL')
+        if not urls:
             print('Missing RSS_FEED_URL in config.')
-        feed = feedparser.parse(app.config['RSS_FEED_URL'])
-        feed.entries.reverse()
-        for entry in feed.entries:
-            existing_entry = FeedEntry.query.filter_by(feed_id=entry.id).first()
-
-            if not existing_entry:  # Only add if it doesn't exist
-                title = html.escape(fix_text(entry.title, unescape_html=False))
-                rss_entry = FeedEntry(
-                    title=title,
-                    feed_id=entry.id,
-                    link=entry.link,
-                    published_at=datetime.strptime(
-                        entry.published, app.config['RSS_PUBLISHED_AT_FORMAT']
-                    ),
-                    description=entry.get('description', ''),
-                )
-                db.session.add(rss_entry)
-
-        db.session.commit()
+            return
+        conditional_headers = get_conditional_headers(urls)
+        feeds = fetch_concurrently(
+            lambda url: fetch_rss_feed_entries(url, conditional_headers.get(url)),
+            urls,
+        )
+        entries = [entry for feed_entries, _ in feeds for entry in feed_entries]
+        existing_ids = get_existing_feed_ids([entry.id for entry in entries])
+        rows = []
+        for entry in entries:
+            if entry.id not in existing_ids:  # Only add if it doesn't exist
+                title = clean_text(entry.title, unescape_html=False)
+                row = {
+                    'title': title,
+                    'feed_id': entry.id,
+                    'link': entry.link,
+                    'description': entry.get('description', ''),
+                }
+                published = entry.get('published')
+                if published:  # Otherwise the column default is used
+                    # Stored as naive UTC, like utc_now
+                    row['published_at'] = (
+                        datetime.fromisoformat(published)
+                        .astimezone(timezone.utc)
+                        .replace(tzinfo=None)
+                    )
+                rows.append(row)
+                existing_ids.add(entry.id)
+
+        insert_feed_entries(rows)
+        save_feed_validators(dict(zip(urls, (headers for _, headers in feeds))))
 
 
 def fetch_json_feed():
     """Fetch and store JSON feed entries in the database.
 
-    This function retrieves the JSON feed from the URL specified in the
-    application configuration. It sends a GET request to the JSON_FEED_URL
-    and, if the response is successful (HTTP status code 200), it parses
-    the JSON data. The function reverses the order of the entries and
-    adds any new entries to the database if they do not already exist.
-    Each entry is stored with its title, feed ID, link, publication date,
-    and description.
+    This function retrieves the JSON feed(s) from the URL or list of URLs
+    specified in the application configuration. It downloads and parses
+    every JSON_FEED_URL in parallel with fetch_json_feed_items, which
+    returns each feed's entries in reverse order, and adds any new entries
+    to the database if they do not already exist. Each entry is stored with its
+    title, feed ID, link, publication date, and description.
 
-    If the response status code is not 200, an error message is printed
-    indicating the failure to fetch the JSON feed. If there is a problem
-    with the URL (e.g., missing schema), a message is printed to the
-    console.
+    If JSON_FEED_URL is not configured, a message is printed to the
+    console. Feeds that can't be fetched or parsed (e.g., a bad URL or a
+    response status code other than 200) print an error message and are
+    skipped.
 
     Returns:
         None
     """
     with app.app_context():
-        try:
-            response = requests.get(app.config['JSON_FEED_URL'])
-            if response.status_code == 200:
-                json_data = response.json()
-                json_data['data'].reverse()
-                for item in json_data['data']:
-                    existing_entry = FeedEntry.query.filter_by(
-                        feed_id=item['id']
-                    ).first()
-
-                    if not existing_entry:  # Only add if it doesn't exist
-                        feed_entry = FeedEntry(
-                            title=fix_text(item['title']),
-                            feed_id=item['id'],
-                            link=item['url'],
-                            published_at=datetime.strptime(
-                                item['date_utc'], app.config['JSON_PUBLISHED_AT_FORMAT']
-                            ),
-                            description=item.get('description', ''),
-                        )
-                        db.session.add(feed_entry)
-
-                db.session.commit()
-            else:
-                print(f"Failed to fetch JSON feed: {response.status_code}")
-        except requests.exceptions.MissingSchema:
+        urls = get_feed_urls('JSON_FEED_URL')
+        if not urls:
             print('Missing or bad URL in config.')
+            return
+        conditional_headers = get_conditional_headers(urls)
+        feeds = fetch_concurrently(
+            lambda url: fetch_json_feed_items(url, conditional_headers.get(url)),
+            urls,
+        )
+        items = [item for feed_items, _ in feeds for item in feed_items]
+        # Feed IDs are stored as strings, but JSON feeds may use numbers
+        existing_ids = get_existing_feed_ids([str(item['id']) for item in items])
+        date_format = app.config['JSON_PUBLISHED_AT_FORMAT']
+        rows = []
+        for item in items:
+            feed_id = str(item['id'])
+            if feed_id not in existing_ids:  # Only add if it doesn't exist
+                rows.append(
+                    {
+                        'title': clean_text(item['title']),
+                        'feed_id': feed_id,
+                        'link': item['url'],
+                        'published_at': parse_published_at(
+                            item['date_utc'], date_format
+                        ),
+                        'description': item.get('description', ''),
+                    }
+                )
+                existing_ids.add(feed_id)
+
+        insert_feed_entries(rows)
+        save_feed_validators(dict(zip(urls, (headers for _, headers in feeds))))
 
 
 @app.route('/', methods=['GET', 'POST'])
@@ -260,24 +319,40 @@ def logout():
 @app.route('/admin')
 @login_required
 def admin():
-    """Render the index page with a list of feed entries.
+    """Render the admin page with a page of feed entries.
 
-    This function retrieves all feed entries from the database, reverses
-    their order, and renders the 'index.html' template. The template is
-    populated with the list of entries and an optional logo specified in
-    the application configuration.
+    This function retrieves one page of feed entries from the database,
+    newest first, and renders the 'admin.html' template. The page number
+    is read from the 'page' query string parameter and the page size from
+    the 'per_page' parameter, which defaults to the ADMIN_PAGE_SIZE setting
+    and is capped at 500. The template is populated with the list
+    of entries, links to the neighbouring pages, and an optional logo
+    specified in the application configuration.
 
     Returns:
-        str: The rendered HTML template for the index page.
+        str: The rendered HTML template for the admin page.
     """
     form = TagForm()
     custom_css = os.path.join(app.static_folder, 'custom.css')
     custom_css_exists = os.path.exists(custom_css)
-    entries = FeedEntry.query.all()
-    entries.reverse()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = request.args.get('per_page', type=int)
+    page_size = min(max(per_page or app.config['ADMIN_PAGE_SIZE'], 1), 500)
+    # Fetch one extra entry to find out whether there is a next page
+    entries = (
+        FeedEntry.query.options(selectinload(FeedEntry.tags))
+        .order_by(FeedEntry.published_at.desc(), FeedEntry.id.desc())
+        .limit(page_size + 1)
+        .offset((page - 1) * page_size)
+        .all()
+    )
+    has_next = len(entries) > page_size
     return render_template(
         'admin.html',
-        entries=entries,
+        entries=entries[:page_size],
+        page=page,
+        per_page=per_page,
+        has_next=has_next,
         logo=app.config['LOGO'],
         f_logo=app.config['FOOTER_LOGO'],
         has_custom_css=custom_css_exists,
@@ -312,12 +387,7 @@ def handle_csrf_error(e):
     Returns:
         str: Rendered HTML of the error template with the error message and logo.
     """
-    return render_template(
-        'error.html',
-        msg=e.description,
-        logo=app.config['LOGO'],
-        f_logo=app.config['FOOTER_LOGO'],
-    )
+    return render_error(e.description)
 
 
 @app.route('/tag_entry/<int:entry_id>', methods=['POST'])
@@ -356,40 +426,23 @@ def tag_entry(entry_id):
         error_msg = 'The form did not validate. Your tag name is probably too long.'
         if is_ajax:
             return jsonify({'error': error_msg}), 400
-        return render_template(
-            'error.html',
-            msg=error_msg,
-            logo=app.config['LOGO'],
-            f_logo=app.config['FOOTER_LOGO'],
-        )
+        return render_error(error_msg)
 
     tag_name = form.tags.data.strip().lower()
-    entry = db.session.get(FeedEntry, entry_id)
+    # Only the ID is needed here, so skip loading the entry's tags
+    entry = db.session.get(FeedEntry, entry_id, options=[lazyload(FeedEntry.tags)])
 
     if entry:
-        tag = Tag.query.filter(Tag.name.ilike(tag_name)).first()
-
-        if not tag:  # If the tag doesn't exist, create it
-            tag = Tag(name=tag_name)
-            db.session.add(tag)
-            db.session.commit()  # Commit to get the tag ID
-
-        if tag not in entry.tags:
-            entry.tags.append(tag)
-            db.session.commit()
-
-        update_or_create_change(1)
+        tag_id = get_or_create_tag(tag_name)
+        bulk_tag([entry.id], [tag_id])
+        update_or_create_change(1, commit=False)
+        db.session.commit()
 
         if is_ajax:
-            return jsonify(tag.id)
+            return jsonify(tag_id)
         return redirect(url_for('admin'))
 
-    return render_template(
-        'error.html',
-        msg='Entry not found!',
-        logo=app.config['LOGO'],
-        f_logo=app.config['FOOTER_LOGO'],
-    )
+    return render_error('Entry not found!')
 
 
 @app.route('/delete_tag/<int:entry_id>/<int:tag_id>', methods=['POST', 'DELETE'])
@@ -417,139 +470,109 @@ def delete_tag(entry_id, tag_id):
         # Remove the tag from the entry
         if tag in entry.tags:
             entry.tags.remove(tag)
+            update_or_create_change(1, commit=False)
             db.session.commit()
-            update_or_create_change(1)
             return redirect(url_for('admin'))
         else:
-            return render_template(
-                'error.html',
-                msg='Tag not associated with this entry!',
-                logo=app.config['LOGO'],
-                f_logo=app.config['FOOTER_LOGO'],
-            )
-    return render_template(
-        'error.html',
-        msg='Entry or tag not found!',
-        logo=app.config['LOGO'],
-        f_logo=app.config['FOOTER_LOGO'],
-    )
+            return render_error('Tag not associated with this entry!')
+    return render_error('Entry or tag not found!')
 
 
 @app.route('/get_feed_rss', methods=['GET'])
 @app.route('/get_feed_rss/tag/<string:tag_name>', methods=['GET'])
 @app.route('/get_feed_rss/tag/<string:tag_name>/<int:limit>', methods=['GET'])
 @app.route('/get_feed_rss/<int:limit>', methods=['GET'])
+@cached_feed
 def get_feed_rss(tag_name=None, limit=None):
     """Generate an RSS feed of feed entries.
 
     This function retrieves feed entries, optionally filtered by a tag
     name and/or limited to a specified number of entries. It constructs
-    and returns an RSS feed in XML format.
+    and returns an RSS feed in XML format from the feed_rss.xml template,
+    which escapes the entry fields. The feed is streamed to the client as
+    the entries are read from the database.
 
     Args:
         tag_name (str, optional): The name of the tag to filter entries.
         limit (int, optional): The maximum number of entries to return.
 
     Returns:
-        tuple: A tuple containing the RSS feed as a string, an HTTP status
-        code (200), and a content type of 'application/rss+xml'.
+        Response: A streamed response containing the RSS feed, with a
+        content type of 'application/rss+xml'.
     """
-    entries = get_entries_by_tag_or_not(tag_name, limit)
-    feed = ''
-    feed += '<?xml version="1.0" encoding="utf-8" ?>\n'
-    feed += '<rss version="2.0">\n'
-    feed += '<channel>\n'
-
-    for entry in entries:
-        feed += '<item>\n'
-        feed += f'<title>{entry.title}</title>\n'
-        feed += f'<link>{entry.link}</link>\n'
-        feed += f'<description>{entry.description}</description>\n'
-        for tag in entry.tags:
-            feed += f'<category term="{tag.name}"/>\n'
-        feed += '</item>\n'
-    feed += '</channel>\n</rss>'
-    return feed, 200, {'Content-Type': 'application/rss+xml'}
+    entries = get_entries_by_tag_or_not(tag_name, limit, batch_size=200)
+    return Response(
+        stream_feed_template('feed_rss.xml', entries=entries),
+        content_type='application/rss+xml',
+    )
 
 
 @app.route('/get_feed_atom', methods=['GET'])
 @app.route('/get_feed_atom/tag/<string:tag_name>', methods=['GET'])
 @app.route('/get_feed_atom/tag/<string:tag_name>/<int:limit>', methods=['GET'])
 @app.route('/get_feed_atom/<int:limit>', methods=['GET'])
+@cached_feed
 def get_feed_atom(tag_name=None, limit=None):
     """Generate an Atom feed of feed entries.
 
     This function retrieves feed entries, optionally filtered by a tag
     name and/or limited to a specified number of entries. It constructs
     and returns an Atom feed in XML format, including metadata such as
-    the feed title and last updated time.
+    the feed title and last updated time, from the feed_atom.xml template,
+    which escapes the entry fields. The feed is streamed to the client as
+    the entries are read from the database.
 
     Args:
         tag_name (str, optional): The name of the tag to filter entries.
         limit (int, optional): The maximum number of entries to return.
 
     Returns:
-        tuple: A tuple containing the Atom feed as a string, an HTTP status
-        code (200), and a content type of 'application/atom+xml'.
+        Response: A streamed response containing the Atom feed.
     """
     try:
         updated = rfc_3339_date(get_change_by_id(1).updated)
     except AttributeError:
         updated = rfc_3339_date(update_or_create_change(1).updated)
 
-    feed_title = app.config['FEED_TITLE']
-    entries = get_entries_by_tag_or_not(tag_name, limit)
-    feed = ''
-    feed += '<?xml version="1.0" encoding="utf-8" ?>\n'
-    feed += '<feed xmlns="http://www.w3.org/2005/Atom">\n'
-    feed += f'<title type="html">{feed_title}</title>\n'
-    feed += f'<id>{request.base_url}</id>\n'
-    feed += f'<updated>{updated}</updated>\n'
-
-    for entry in entries:
-        feed += '<entry>\n'
-        feed += f'<title type="html">{entry.title}</title>\n'
-        feed += f'<id>{entry.id}</id>\n'
-        feed += f'<link href="{entry.link}" rel="alternate" type="text/html"/>\n'
-        feed += f'<content type="html"><![CDATA[ {entry.description} ]]></content>\n'
-        for tag in entry.tags:
-            feed += f'<category term="{tag.name}"/>\n'
-        feed += '</entry>\n'
-    feed += '</feed>\n'
-    return feed, 200, {'Content-Type': 'application/rss+xml'}
+    entries = get_entries_by_tag_or_not(tag_name, limit, batch_size=200)
+    return Response(
+        stream_feed_template(
+            'feed_atom.xml',
+            feed_title=app.config['FEED_TITLE'],
+            feed_id=request.base_url,
+            updated=updated,
+            entries=entries,
+        ),
+        content_type='application/rss+xml',
+    )
 
 
 @app.route('/get_feed_json', methods=['GET'])
 @app.route('/get_feed_json/tag/<string:tag_name>', methods=['GET'])
 @app.route('/get_feed_json/tag/<string:tag_name>/<int:limit>', methods=['GET'])
 @app.route('/get_feed_json/<int:limit>', methods=['GET'])
+@cached_feed
 def get_feed_json(tag_name=None, limit=None):
     """Generate a JSON feed of feed entries.
 
     This function retrieves feed entries, optionally filtered by a tag
-    name and/or limited to a specified number of entries. It constructs
-    and returns a JSON representation of the feed entries.
+    name and/or limited to a specified number of entries, with their tag
+    names aggregated in the same query. It constructs and returns a JSON
+    representation of the feed entries.
 
     Args:
         tag_name (str, optional): The name of the tag to filter entries.
         limit (int, optional): The maximum number of entries to return.
 
     Returns:
-        Response: A JSON response containing a list of feed entries.
+        Response: A JSON response containing a list of feed entries,
+        encoded with orjson.
     """
-    entries = get_entries_by_tag_or_not(tag_name, limit)
-    feed_data = []
-
-    for entry in entries:
-        entry_data = {
-            'title': entry.title,
-            'link': entry.link,
-            'description': entry.description,
-            'tags': [tag.name for tag in entry.tags],
-        }
-        feed_data.append(entry_data)
-
-    return jsonify(feed_data)
+    feed_data = get_entry_data_by_tag_or_not(tag_name, limit)
+    return app.response_class(
+        orjson.dumps(feed_data, option=orjson.OPT_SORT_KEYS),
+        mimetype='application/json',
+    )
 
 
 @app.route('/refresh_feed', methods=['POST'])
@@ -571,48 +594,87 @@ def refresh_feed():
 
 @app.cli.command('fetch_feed')
 @click.argument('mode')
-def fetch_feed(mode):
+@click.option(
+    '--every',
+    type=click.IntRange(min=1),
+    metavar='MINUTES',
+    help='Keep running and fetch the feed again every MINUTES minutes.',
+)
+def fetch_feed(mode, every):
     """Fetch and import feed entries into the SQLite database.
 
     This command fetches entries from a specified feed type (JSON or RSS)
     and imports them into the SQLite database. The mode argument determines
-    the type of feed to fetch.
+    the type of feed to fetch. With --every, the command keeps running and
+    fetches the feed on a schedule, outside of the web workers. A failed
+    scheduled fetch is reported and retried at the next interval.
 
     Args:
         mode (str): The type of feed to fetch. Must be either "json" or "rss".
+        every (int, optional): The number of minutes between fetches.
 
     Usage:
         To fetch a JSON feed:
             flask fetch_feed json
 
-        To fetch an RSS feed:
-            flask fetch_feed rss
+        To fetch an RSS feed every 15 minutes:
+            flask fetch_feed rss --every 15
     """
     mode = mode.lower()
     if mode == 'json':
-        fetch_json_feed()
+        fetch = fetch_json_feed
     elif mode == 'rss':
-        fetch_rss_feed()
+        fetch = fetch_rss_feed
     else:
         print(
             'You must specify what kind of a feed to fetch. Only "json" and "rss" are recognized.'
         )
+        return
 
+    fetch()
+    while every:
+        time.sleep(every * 60)
+        try:
+            fetch()
+        except Exception as e:
+            print(f'Failed to fetch {mode} feed: {e}')
 
-# Load optional overrides
-try:
-    from custom_functions import *  # noqa
-except ImportError:
-    pass
 
-with app.app_context():
+@app.cli.command('init-db')
+def init_db():
+    """Create any missing database tables.
+
+    Run this once when deploying, and again after upgrading if new models
+    were added. Tables are no longer created every time the app is
+    imported, so web workers skip the schema checks on startup.
+
+    Usage:
+        flask init-db
+    """
     db.create_all()
+    print('Database tables created.')
+
+
+@app.cli.command('unescape-titles')
+def unescape_titles():
+    """Unescape feed entry titles stored HTML-escaped by older versions.
+
+    Run this once after upgrading from a version that escaped RSS titles on
+    import, since the feeds and the admin page now escape titles
+    themselves. See unescape_entry_titles.
+
+    Usage:
+        flask unescape-titles
+    """
+    count = unescape_entry_titles()
+    print(f'Unescaped {count} titles.')
+
+
+# Load optional overrides. Errors inside custom_functions are raised.
+if find_spec('custom_functions') is not None:
+    from custom_functions import *  # noqa
 
 if __name__ == '__main__':
     with app.app_context():
-        # Fetch feeds when the app starts
-        if app.config['FETCH_MODE'].lower() == 'json':
-            fetch_json_feed()
-        else:
-            fetch_rss_feed()
+        db.create_all()
     app.run(debug=True)
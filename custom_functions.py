@@ -1,10 +1,14 @@
-import html
-
-import feedparser
-from ftfy import fix_text
-
-from _config import app, db
-from models import FeedEntry
+from _config import app
+from functions import (
+    clean_text,
+    fetch_concurrently,
+    fetch_rss_feed_entries,
+    get_conditional_headers,
+    get_existing_feed_ids,
+    get_feed_urls,
+    insert_feed_entries,
+    save_feed_validators,
+)
 
 
 def fetch_rss_feed():
@@ -23,20 +27,30 @@ def fetch_rss_feed():
         None
     """
     with app.app_context():
-        if not app.config['RSS_FEED_URL']:
+        urls = get_feed_urls('RSS_FEED_URL')
+        if not urls:
             print('Missing RSS_FEED_URL in config.')
-        feed = feedparser.parse(app.config['RSS_FEED_URL'])
-        for entry in feed.entries:
-            existing_entry = FeedEntry.query.filter_by(feed_id=entry.id).first()
-
-            if not existing_entry:
-                title = html.escape(fix_text(entry.title, unescape_html=False))
-                rss_entry = FeedEntry(
-                    title=title,
-                    feed_id=entry.id,
-                    link=entry.link,
-                    description=entry.get('description', ''),
+            return
+        conditional_headers = get_conditional_headers(urls)
+        feeds = fetch_concurrently(
+            lambda url: fetch_rss_feed_entries(url, conditional_headers.get(url)),
+            urls,
+        )
+        entries = [entry for feed_entries, _ in feeds for entry in feed_entries]
+        existing_ids = get_existing_feed_ids([entry.id for entry in entries])
+        rows = []
+        for entry in entries:
+            if entry.id not in existing_ids:
+                title = clean_text(entry.title, unescape_html=False)
+                rows.append(
+                    {
+                        'title': title,
+                        'feed_id': entry.id,
+                        'link': entry.link,
+                        'description': entry.get('description', ''),
+                    }
                 )
-                db.session.add(rss_entry)
+                existing_ids.add(entry.id)
 
-        db.session.commit()
+        insert_feed_entries(rows)
+        save_feed_validators(dict(zip(urls, (headers for _, headers in feeds))))
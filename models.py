@@ -1,8 +1,44 @@
-from datetime import datetime
+from datetime import datetime, timezone
+from importlib.util import find_spec
 
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects import mysql, postgresql
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declared_attr
+from sqlalchemy.orm import validates
+from sqlalchemy.sql.expression import FunctionElement
 
-from _config import db
+from _config import app, db
+
+
+def utc_now():
+    """Get the current UTC time as a naive datetime, as stored in the database.
+
+    Returns:
+        datetime: The current UTC time without tzinfo.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class utc_timestamp(FunctionElement):
+    """The database's current UTC time, for use as a server default.
+
+    CURRENT_TIMESTAMP is already UTC on SQLite. PostgreSQL returns the
+    session's local time, so the value is converted to UTC there.
+    """
+
+    type = db.DateTime()
+    inherit_cache = True
+
+
+@compiles(utc_timestamp)
+def _compile_utc_timestamp(element, compiler, **kw):
+    return 'CURRENT_TIMESTAMP'
+
+
+@compiles(utc_timestamp, 'postgresql')
+def _compile_pg_utc_timestamp(element, compiler, **kw):
+    return "(CURRENT_TIMESTAMP AT TIME ZONE 'utc')"
 
 
 class FeedEntryTag(db.Model):
@@ -10,14 +46,45 @@ class FeedEntryTag(db.Model):
 
     This model represents the many-to-many relationship between
     FeedEntry and Tag, allowing a feed entry to have multiple tags
-    and a tag to be associated with multiple feed entries.
+    and a tag to be associated with multiple feed entries. Each pair of
+    feed entry and tag is the primary key, so it can only be stored once.
+    The primary key index covers looking up the tags of an entry, and a
+    second index on (tag_id, feed_entry_id) covers looking up the entries
+    with a tag. Tables created by older versions keep a surrogate id and
+    have neither the composite key nor the second index, since create_all
+    does not alter existing tables; bulk_tag checks for existing pairs so
+    they don't get duplicates either.
+
+    On PostgreSQL the table can be hash partitioned by tag_id, with the
+    number of partitions set by FEED_ENTRY_TAG_PARTITIONS, to spread
+    writes and keep each partition's indexes small.
     """
 
-    id = db.Column(db.Integer, primary_key=True)
+    __table_args__ = (
+        db.Index('ix_fet_tag_entry', 'tag_id', 'feed_entry_id'),
+        (
+            {'postgresql_partition_by': 'HASH (tag_id)'}
+            if app.config['FEED_ENTRY_TAG_PARTITIONS']
+            else {}
+        ),
+    )
+
     feed_entry_id = db.Column(
-        db.Integer, db.ForeignKey('feed_entry.id'), nullable=False
+        db.Integer, db.ForeignKey('feed_entry.id'), primary_key=True
+    )
+    tag_id = db.Column(db.Integer, db.ForeignKey('tag.id'), primary_key=True)
+
+
+_partitions = app.config['FEED_ENTRY_TAG_PARTITIONS']
+for _remainder in range(_partitions):
+    event.listen(
+        FeedEntryTag.__table__,
+        'after_create',
+        DDL(
+            f'CREATE TABLE feed_entry_tag_p{_remainder} PARTITION OF feed_entry_tag '
+            f'FOR VALUES WITH (MODULUS {_partitions}, REMAINDER {_remainder})'
+        ).execute_if(dialect='postgresql'),
     )
-    tag_id = db.Column(db.Integer, db.ForeignKey('tag.id'), nullable=False)
 
 
 class Tag(db.Model):
@@ -25,11 +92,35 @@ class Tag(db.Model):
 
     This model corresponds to the 'tag' table in the database and
     contains information about tags that can be associated with
-    feed entries.
+    feed entries. Tag names are always stored in lowercase, so they can
+    be looked up case-insensitively with an exact match on the index.
     """
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(50), unique=True, nullable=False)
+    # Names are lowercased, so byte-wise collations compare them correctly
+    # and faster than the locale-aware defaults. SQLite already compares
+    # bytes.
+    name = db.Column(
+        db.String(50)
+        .with_variant(postgresql.VARCHAR(50, collation='C'), 'postgresql')
+        .with_variant(mysql.VARCHAR(50, collation='utf8mb4_bin'), 'mysql', 'mariadb'),
+        unique=True,
+        nullable=False,
+        index=True,
+    )
+
+    # A tag can have any number of entries, so loading them all by accident
+    # raises instead of running a huge SELECT. Query the entries instead.
+    feed_entries = db.relationship(
+        'FeedEntry',
+        secondary='feed_entry_tag',
+        back_populates='tags',
+        lazy='raise_on_sql',
+    )
+
+    @validates('name')
+    def lowercase_name(self, key, name):
+        return name.lower()
 
 
 class AbstractFeedEntry(db.Model):
@@ -51,41 +142,31 @@ class AbstractFeedEntry(db.Model):
 
     __abstract__ = True
 
-    @declared_attr
-    def id(cls):
-        return db.Column(db.Integer, primary_key=True)
-
-    @declared_attr
-    def feed_id(cls):
-        return db.Column(db.String(200), unique=True, nullable=False)
-
-    @declared_attr
-    def title(cls):
-        return db.Column(db.String(200), nullable=False)
-
-    @declared_attr
-    def link(cls):
-        return db.Column(db.String(200), nullable=False)
-
-    @declared_attr
-    def published_at(cls):
-        return db.Column(db.DateTime, default=datetime.utcnow)
-
-    @declared_attr
-    def description(cls):
-        return db.Column(db.Text, nullable=True)
+    # Plain columns on an abstract model are copied to each subclass
+    id = db.Column(db.Integer, primary_key=True)
+    feed_id = db.Column(db.String(200), unique=True, nullable=False, index=True)
+    title = db.Column(db.String(200), nullable=False)
+    link = db.Column(db.String(200), nullable=False)
+    published_at = db.Column(
+        db.DateTime, default=utc_now, server_default=utc_timestamp(), nullable=False
+    )
+    description = db.Column(db.Text, nullable=True)
 
     @declared_attr
     def tags(cls):
+        # Load the tags of every entry in a query with one extra SELECT ... IN
         return db.relationship(
-            'Tag', secondary='feed_entry_tag', backref='feed_entries'
+            'Tag',
+            secondary='feed_entry_tag',
+            back_populates='feed_entries',
+            lazy='selectin',
         )
 
 
-try:
+# Use the custom base model if there is one. Errors inside custom_models
+# are raised instead of silently falling back to the default model.
+if find_spec('custom_models') is not None:
     from custom_models import AbstractFeedEntry  # noqa
-except ImportError:
-    pass
 
 
 class FeedEntry(AbstractFeedEntry):
@@ -93,9 +174,11 @@ class FeedEntry(AbstractFeedEntry):
 
     This class inherits from AbstractFeedEntry and represents a specific
     feed entry with all the attributes defined in the abstract base class.
+    Entries are listed newest first, by publication date and then ID, so
+    that order is indexed.
     """
 
-    pass
+    __table_args__ = (db.Index('ix_fe_pub_id', 'published_at', 'id'),)
 
 
 class Changes(db.Model):
@@ -110,4 +193,26 @@ class Changes(db.Model):
     """
 
     id = db.Column(db.Integer, primary_key=True)
-    updated = db.Column(db.DateTime, default=datetime.utcnow)
+    updated = db.Column(
+        db.DateTime, default=utc_now, server_default=utc_timestamp(), nullable=False
+    )
+
+
+class FeedMeta(db.Model):
+    """Represents the HTTP cache validators for a fetched feed.
+
+    The ETag and Last-Modified headers from the last successful fetch of
+    each feed URL are kept so the next fetch can be a conditional GET.
+
+    Attributes:
+        id (int): The unique identifier for the record.
+        url (str): The feed URL.
+        etag (str): The ETag header of the last response, if any.
+        last_modified (str): The Last-Modified header of the last response,
+            if any.
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    url = db.Column(db.String(500), unique=True, nullable=False)
+    etag = db.Column(db.String(200), nullable=True)
+    last_modified = db.Column(db.String(100), nullable=True)